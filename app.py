@@ -1,17 +1,84 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, session, flash
+from flask import Flask, render_template, request, redirect, url_for, session, flash, g, stream_with_context
+from flask.json.provider import DefaultJSONProvider
+from flask_compress import Compress
+from flask_session import Session
 from flask_sqlalchemy import SQLAlchemy
-from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy import event, func, insert, select
+from sqlalchemy.orm import raiseload
+from werkzeug.security import check_password_hash
+from argon2 import PasswordHasher
+from argon2.exceptions import VerificationError, InvalidHashError
 from datetime import datetime
-import json
+from cachetools import TTLCache, cached
+import orjson
 import os
+import redis
+import threading
+
+class OrjsonProvider(DefaultJSONProvider):
+    # Route flask.json (sessions, flash, request.get_json) through orjson
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
 
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 app.config['SECRET_KEY'] = os.urandom(24)
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///surveycraft.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+    # Used by db.JSON columns
+    'json_serializer': lambda obj: orjson.dumps(obj).decode(),
+    'json_deserializer': orjson.loads,
+}
+
+# Compress larger JSON/HTML responses; Brotli for clients that accept it, else gzip
+app.config['COMPRESS_ALGORITHM'] = ['br', 'gzip']
+app.config['COMPRESS_MIN_SIZE'] = 512
+# Streamed bodies (the survey list) use their own list, which omits gzip by default
+app.config['COMPRESS_ALGORITHM_STREAMING'] = ['br', 'gzip']
+Compress(app)
+
+# Server-side sessions keep only an opaque id in the cookie; without Redis,
+# fall back to Flask's signed-cookie sessions
+if os.environ.get('REDIS_URL'):
+    app.config['SESSION_TYPE'] = 'redis'
+    app.config['SESSION_REDIS'] = redis.Redis.from_url(os.environ['REDIS_URL'])
+    Session(app)
 
 db = SQLAlchemy(app)
 
+# Argon2id with OWASP's 46 MiB / t=1 / p=1 parameters
+password_hasher = PasswordHasher(memory_cost=47104, time_cost=1, parallelism=1)
+
+# Naive datetimes in the DB are UTC; orjson serializes them natively as ISO 8601
+_ORJSON_OPTIONS = orjson.OPT_NAIVE_UTC | orjson.OPT_UTC_Z
+
+def _json_response(obj, status=200):
+    return app.response_class(orjson.dumps(obj, option=_ORJSON_OPTIONS), status=status, mimetype='application/json')
+
+_NOT_FOUND = (orjson.dumps({'error': 'Not Found'}), 404)
+_UNAUTHORIZED = (orjson.dumps({'error': 'Unauthorized'}), 401)
+_FORBIDDEN = (orjson.dumps({'error': 'Forbidden'}), 403)
+
+# Response objects pick up per-request headers (cookies, Vary), so only the
+# encoded bodies are shared
+def _not_found():
+    return app.response_class(*_NOT_FOUND, mimetype='application/json')
+
+def _unauthorized():
+    return app.response_class(*_UNAUTHORIZED, mimetype='application/json')
+
+def _forbidden():
+    return app.response_class(*_FORBIDDEN, mimetype='application/json')
+
+def _not_modified(etag):
+    response = app.response_class(status=304)
+    response.set_etag(etag, weak=True)
+    return response
+
 # Database Models
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -22,10 +89,21 @@ class User(db.Model):
     surveys = db.relationship('Survey', backref='creator', lazy=True)
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = password_hasher.hash(password)
     
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        # Accounts created before the Argon2 switch still hold Werkzeug PBKDF2 hashes
+        if not self.password_hash.startswith('$argon2'):
+            return check_password_hash(self.password_hash, password)
+        try:
+            return password_hasher.verify(self.password_hash, password)
+        except (VerificationError, InvalidHashError):
+            return False
+    
+    def needs_rehash(self):
+        if not self.password_hash.startswith('$argon2'):
+            return True
+        return password_hasher.check_needs_rehash(self.password_hash)
 
 class Survey(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -38,6 +116,11 @@ class Survey(db.Model):
     questions = db.relationship('Question', backref='survey', lazy=True, cascade="all, delete-orphan")
     responses = db.relationship('Response', backref='survey', lazy=True)
 
+    __table_args__ = (
+        # Dashboard and survey list filter by owner, newest first
+        db.Index('ix_survey_user_created', 'user_id', db.text('created_at DESC')),
+    )
+
 class Question(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     survey_id = db.Column(db.Integer, db.ForeignKey('survey.id'), nullable=False)
@@ -45,19 +128,37 @@ class Question(db.Model):
     text = db.Column(db.Text, nullable=False)
     description = db.Column(db.Text)
     required = db.Column(db.Boolean, default=False)
-    options = db.Column(db.Text)  # JSON string for options
+    options = db.Column(db.JSON)  # list of choices
     order = db.Column(db.Integer, default=0)
 
 class Response(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     survey_id = db.Column(db.Integer, db.ForeignKey('survey.id'), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
-    response_data = db.Column(db.Text)  # JSON string of responses
+    response_data = db.Column(db.JSON)  # submitted answers
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        db.Index('ix_response_survey', 'survey_id'),
+    )
+
 # Create tables
 with app.app_context():
+    @event.listens_for(db.engine, 'connect')
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        # WAL lets dashboard reads proceed while a response is being written
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.execute('PRAGMA cache_size=-65536')  # 64 MiB
+        cursor.execute('PRAGMA mmap_size=268435456')  # 256 MiB
+        cursor.close()
+    
     db.create_all()
+    # create_all skips tables that already exist, so add any new indexes explicitly
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
 
 # Routes
 @app.route('/')
@@ -72,9 +173,14 @@ def login():
         email = request.form.get('email')
         password = request.form.get('password')
         
-        user = User.query.filter_by(email=email).first()
+        user = db.session.scalar(select(User).where(User.email == email))
         
         if user and user.check_password(password):
+            # Upgrade legacy or outdated hashes while we have the plaintext
+            if user.needs_rehash():
+                user.set_password(password)
+                db.session.commit()
+            
             session['user_id'] = user.id
             session['user_name'] = user.name
             return redirect(url_for('index'))
@@ -91,7 +197,7 @@ def signup():
         password = request.form.get('password')
         
         # Check if user already exists
-        existing_user = User.query.filter_by(email=email).first()
+        existing_user = db.session.scalar(select(User).where(User.email == email))
         if existing_user:
             flash('Email already registered')
             return redirect(url_for('signup'))
@@ -115,36 +221,71 @@ def logout():
     session.clear()
     return redirect(url_for('login'))
 
+# API endpoints reachable without logging in
+_PUBLIC_API_ENDPOINTS = {'submit_response'}
+
+@app.before_request
+def _require_login():
+    if not request.path.startswith('/api/'):
+        return None
+    # Read the session once; handlers use g.user_id from here on
+    g.user_id = session.get('user_id')
+    if g.user_id is None and request.endpoint not in _PUBLIC_API_ENDPOINTS:
+        return _unauthorized()
+
 # API Routes for Surveys
 @app.route('/api/surveys', methods=['GET'])
 def get_surveys():
-    if 'user_id' not in session:
-        return jsonify({'error': 'Unauthorized'}), 401
-    
-    user_id = session['user_id']
-    surveys = Survey.query.filter_by(user_id=user_id).all()
-    
-    result = []
-    for survey in surveys:
-        result.append({
-            'id': survey.id,
-            'title': survey.title,
-            'description': survey.description,
-            'status': survey.status,
-            'created_at': survey.created_at.isoformat(),
-            'updated_at': survey.updated_at.isoformat(),
-            'responses_count': len(survey.responses)
-        })
+    user_id = g.user_id
+    
+    # Cheap fingerprint of the list: edits bump updated_at, creates/deletes change
+    # the survey count and new responses change the response count
+    last_updated, surveys_count, total_responses = db.session.execute(
+        select(func.max(Survey.updated_at), func.count(Survey.id.distinct()), func.count(Response.id))
+        .select_from(Survey)
+        .outerjoin(Response)
+        .where(Survey.user_id == user_id)
+    ).one()
+    etag = f'{user_id}-{surveys_count}-{total_responses}-{last_updated:%Y%m%d%H%M%S%f}' if last_updated else f'{user_id}-0'
+    if request.if_none_match.contains_weak(etag):
+        return _not_modified(etag)
+    
+    # One aggregate query instead of lazy-loading responses per survey, fetched
+    # in batches so large accounts never hold every Survey in memory at once
+    rows = db.session.execute(
+        select(Survey, func.count(Response.id))
+        .outerjoin(Response)
+        .where(Survey.user_id == user_id)
+        .group_by(Survey.id)
+        .execution_options(yield_per=200)
+    )
     
-    return jsonify(result)
+    def generate():
+        yield b'['
+        first = True
+        for partition in rows.partitions():
+            chunk = b','.join(orjson.dumps({
+                'id': survey.id,
+                'title': survey.title,
+                'description': survey.description,
+                'status': survey.status,
+                'created_at': survey.created_at,
+                'updated_at': survey.updated_at,
+                'responses_count': responses_count
+            }, option=_ORJSON_OPTIONS) for survey, responses_count in partition)
+            yield chunk if first else b',' + chunk
+            first = False
+        yield b']'
+    
+    # The DB session lives in the app context, which must outlast the generator
+    response = app.response_class(stream_with_context(generate()), mimetype='application/json')
+    response.set_etag(etag, weak=True)
+    return response
 
 @app.route('/api/surveys', methods=['POST'])
 def create_survey():
-    if 'user_id' not in session:
-        return jsonify({'error': 'Unauthorized'}), 401
-    
     data = request.get_json()
-    user_id = session['user_id']
+    user_id = g.user_id
     
     new_survey = Survey(
         title=data['title'],
@@ -154,27 +295,34 @@ def create_survey():
     
     db.session.add(new_survey)
     db.session.commit()
+    _invalidate_stats(user_id)
     
-    return jsonify({
+    return _json_response({
         'id': new_survey.id,
         'title': new_survey.title,
         'description': new_survey.description,
         'status': new_survey.status,
-        'created_at': new_survey.created_at.isoformat()
-    }), 201
+        'created_at': new_survey.created_at
+    }, 201)
 
 @app.route('/api/surveys/<int:survey_id>', methods=['GET'])
 def get_survey(survey_id):
-    if 'user_id' not in session:
-        return jsonify({'error': 'Unauthorized'}), 401
+    # Any lazy load here is a bug; questions are queried explicitly below
+    survey = db.session.get(Survey, survey_id, options=[raiseload('*')])
+    if survey is None:
+        return _not_found()
     
-    survey = Survey.query.get_or_404(survey_id)
+    if survey.user_id != g.user_id:
+        return _forbidden()
     
-    if survey.user_id != session['user_id']:
-        return jsonify({'error': 'Forbidden'}), 403
+    # Question edits bump survey.updated_at, so it versions the whole payload
+    etag = f'{survey.id}-{survey.updated_at:%Y%m%d%H%M%S%f}'
+    if request.if_none_match.contains_weak(etag):
+        return _not_modified(etag)
     
+    # Only load questions once we know the client's copy is stale
     questions = []
-    for question in survey.questions:
+    for question in db.session.scalars(select(Question).where(Question.survey_id == survey.id)):
         q_data = {
             'id': question.id,
             'type': question.type,
@@ -184,30 +332,31 @@ def get_survey(survey_id):
             'order': question.order
         }
         
-        if question.options:
-            q_data['options'] = json.loads(question.options)
+        if question.options is not None:
+            q_data['options'] = question.options
         
         questions.append(q_data)
     
-    return jsonify({
+    response = _json_response({
         'id': survey.id,
         'title': survey.title,
         'description': survey.description,
         'status': survey.status,
-        'created_at': survey.created_at.isoformat(),
-        'updated_at': survey.updated_at.isoformat(),
+        'created_at': survey.created_at,
+        'updated_at': survey.updated_at,
         'questions': questions
     })
+    response.set_etag(etag, weak=True)
+    return response
 
 @app.route('/api/surveys/<int:survey_id>', methods=['PUT'])
 def update_survey(survey_id):
-    if 'user_id' not in session:
-        return jsonify({'error': 'Unauthorized'}), 401
+    survey = db.session.get(Survey, survey_id)
+    if survey is None:
+        return _not_found()
     
-    survey = Survey.query.get_or_404(survey_id)
-    
-    if survey.user_id != session['user_id']:
-        return jsonify({'error': 'Forbidden'}), 403
+    if survey.user_id != g.user_id:
+        return _forbidden()
     
     data = request.get_json()
     
@@ -218,39 +367,38 @@ def update_survey(survey_id):
     
     db.session.commit()
     
-    return jsonify({
+    return _json_response({
         'id': survey.id,
         'title': survey.title,
         'description': survey.description,
         'status': survey.status,
-        'updated_at': survey.updated_at.isoformat()
+        'updated_at': survey.updated_at
     })
 
 @app.route('/api/surveys/<int:survey_id>', methods=['DELETE'])
 def delete_survey(survey_id):
-    if 'user_id' not in session:
-        return jsonify({'error': 'Unauthorized'}), 401
-    
-    survey = Survey.query.get_or_404(survey_id)
+    survey = db.session.get(Survey, survey_id)
+    if survey is None:
+        return _not_found()
     
-    if survey.user_id != session['user_id']:
-        return jsonify({'error': 'Forbidden'}), 403
+    if survey.user_id != g.user_id:
+        return _forbidden()
     
     db.session.delete(survey)
     db.session.commit()
+    _invalidate_stats(survey.user_id)
     
     return '', 204
 
 # API Routes for Questions
 @app.route('/api/surveys/<int:survey_id>/questions', methods=['POST'])
 def create_question(survey_id):
-    if 'user_id' not in session:
-        return jsonify({'error': 'Unauthorized'}), 401
+    survey = db.session.get(Survey, survey_id)
+    if survey is None:
+        return _not_found()
     
-    survey = Survey.query.get_or_404(survey_id)
-    
-    if survey.user_id != session['user_id']:
-        return jsonify({'error': 'Forbidden'}), 403
+    if survey.user_id != g.user_id:
+        return _forbidden()
     
     data = request.get_json()
     
@@ -260,32 +408,94 @@ def create_question(survey_id):
         text=data['text'],
         description=data.get('description', ''),
         required=data.get('required', False),
-        options=json.dumps(data.get('options', [])),
+        options=data.get('options', []),
         order=data.get('order', 0)
     )
     
     db.session.add(new_question)
+    survey.updated_at = datetime.utcnow()
     db.session.commit()
     
-    return jsonify({
+    return _json_response({
         'id': new_question.id,
         'type': new_question.type,
         'text': new_question.text,
         'description': new_question.description,
         'required': new_question.required,
-        'options': json.loads(new_question.options) if new_question.options else [],
+        'options': new_question.options or [],
         'order': new_question.order
-    }), 201
+    }, 201)
+
+# Caps the size of the single executemany INSERT behind the bulk endpoint
+_MAX_BULK_QUESTIONS = 500
+
+@app.route('/api/surveys/<int:survey_id>/questions:bulk', methods=['POST'])
+def create_questions_bulk(survey_id):
+    survey = db.session.get(Survey, survey_id)
+    if survey is None:
+        return _not_found()
+    
+    if survey.user_id != g.user_id:
+        return _forbidden()
+    
+    data = request.get_json()
+    
+    if not isinstance(data, dict) or not isinstance(data.get('questions'), list):
+        return _json_response({'error': 'questions must be a list'}, 400)
+    
+    if len(data['questions']) > _MAX_BULK_QUESTIONS:
+        return _json_response({'error': f'at most {_MAX_BULK_QUESTIONS} questions per request'}, 413)
+    
+    if not all(isinstance(q, dict) for q in data['questions']):
+        return _json_response({'error': 'each question must be an object'}, 400)
+    
+    if not all(isinstance(q.get('type'), str) and isinstance(q.get('text'), str) for q in data['questions']):
+        return _json_response({'error': 'each question needs a type and text'}, 400)
+    
+    # An empty parameter list would run a single INSERT with no values
+    if not data['questions']:
+        return _json_response([], 201)
+    
+    rows = [{
+        'survey_id': survey_id,
+        'type': q['type'],
+        'text': q['text'],
+        'description': q.get('description', ''),
+        'required': q.get('required', False),
+        'options': q.get('options', []),
+        'order': q.get('order', 0)
+    } for q in data['questions']]
+    
+    # Single executemany INSERT in one transaction instead of a commit per question
+    new_questions = db.session.scalars(
+        insert(Question).returning(Question, sort_by_parameter_order=True),
+        rows
+    ).all()
+    
+    # Build the payload before commit expires the loaded attributes
+    result = [{
+        'id': question.id,
+        'type': question.type,
+        'text': question.text,
+        'description': question.description,
+        'required': question.required,
+        'options': question.options or [],
+        'order': question.order
+    } for question in new_questions]
+    
+    survey.updated_at = datetime.utcnow()
+    db.session.commit()
+    
+    return _json_response(result, 201)
 
 @app.route('/api/questions/<int:question_id>', methods=['PUT'])
 def update_question(question_id):
-    if 'user_id' not in session:
-        return jsonify({'error': 'Unauthorized'}), 401
+    question = db.session.get(Question, question_id)
+    if question is None:
+        return _not_found()
     
-    question = Question.query.get_or_404(question_id)
-    
-    if question.survey.user_id != session['user_id']:
-        return jsonify({'error': 'Forbidden'}), 403
+    if question.survey.user_id != g.user_id:
+        return _forbidden()
     
     data = request.get_json()
     
@@ -293,31 +503,32 @@ def update_question(question_id):
     question.text = data.get('text', question.text)
     question.description = data.get('description', question.description)
     question.required = data.get('required', question.required)
-    question.options = json.dumps(data.get('options', json.loads(question.options) if question.options else []))
+    question.options = data.get('options', question.options or [])
     question.order = data.get('order', question.order)
+    question.survey.updated_at = datetime.utcnow()
     
     db.session.commit()
     
-    return jsonify({
+    return _json_response({
         'id': question.id,
         'type': question.type,
         'text': question.text,
         'description': question.description,
         'required': question.required,
-        'options': json.loads(question.options) if question.options else [],
+        'options': question.options or [],
         'order': question.order
     })
 
 @app.route('/api/questions/<int:question_id>', methods=['DELETE'])
 def delete_question(question_id):
-    if 'user_id' not in session:
-        return jsonify({'error': 'Unauthorized'}), 401
-    
-    question = Question.query.get_or_404(question_id)
+    question = db.session.get(Question, question_id)
+    if question is None:
+        return _not_found()
     
-    if question.survey.user_id != session['user_id']:
-        return jsonify({'error': 'Forbidden'}), 403
+    if question.survey.user_id != g.user_id:
+        return _forbidden()
     
+    question.survey.updated_at = datetime.utcnow()
     db.session.delete(question)
     db.session.commit()
     
@@ -326,37 +537,47 @@ def delete_question(question_id):
 # API Route for Submitting Responses
 @app.route('/api/surveys/<int:survey_id>/responses', methods=['POST'])
 def submit_response(survey_id):
-    survey = Survey.query.get_or_404(survey_id)
+    survey = db.session.get(Survey, survey_id)
+    if survey is None:
+        return _not_found()
     
     if survey.status != 'active':
-        return jsonify({'error': 'Survey is not active'}), 400
+        return _json_response({'error': 'Survey is not active'}, 400)
     
     data = request.get_json()
     
-    new_response = Response(
+    owner_id = survey.user_id
+    
+    # Plain INSERT ... RETURNING; no ORM instance to build or track
+    stmt = insert(Response).values(
         survey_id=survey_id,
-        user_id=session.get('user_id'),
-        response_data=json.dumps(data)
-    )
+        user_id=g.user_id,
+        response_data=data
+    ).returning(Response.id)
     
-    db.session.add(new_response)
+    new_id = db.session.execute(stmt).scalar_one()
     db.session.commit()
+    _invalidate_stats(owner_id)
     
-    return jsonify({'id': new_response.id}), 201
+    return _json_response({'id': new_id}, 201)
 
-# API Route for Dashboard Stats
-@app.route('/api/dashboard/stats', methods=['GET'])
-def get_dashboard_stats():
-    if 'user_id' not in session:
-        return jsonify({'error': 'Unauthorized'}), 401
-    
-    user_id = session['user_id']
-    
-    # Count surveys
-    surveys_count = Survey.query.filter_by(user_id=user_id).count()
-    
-    # Count responses
-    responses_count = Response.query.join(Survey).filter(Survey.user_id == user_id).count()
+# Dashboard stats are polled by the UI; keep them per user for a few seconds
+_stats_cache = TTLCache(maxsize=1024, ttl=10)
+_stats_lock = threading.Lock()
+
+def _invalidate_stats(user_id):
+    with _stats_lock:
+        _stats_cache.pop(user_id, None)
+
+@cached(_stats_cache, key=lambda user_id: user_id, lock=_stats_lock)
+def _compute_stats(user_id):
+    # Count surveys and their responses in one round trip
+    surveys_count, responses_count = db.session.execute(
+        select(func.count(Survey.id.distinct()), func.count(Response.id))
+        .select_from(Survey)
+        .outerjoin(Response)
+        .where(Survey.user_id == user_id)
+    ).one()
     
     # Calculate completion rate (dummy calculation for demo)
     completion_rate = 74  # In a real app, this would be calculated
@@ -364,33 +585,37 @@ def get_dashboard_stats():
     # Active users (dummy calculation for demo)
     active_users = 12
     
-    return jsonify({
+    return {
         'surveys': surveys_count,
         'responses': responses_count,
         'completion': completion_rate,
         'active': active_users
-    })
+    }
+
+# API Route for Dashboard Stats
+@app.route('/api/dashboard/stats', methods=['GET'])
+def get_dashboard_stats():
+    return _json_response(_compute_stats(g.user_id))
 
 # API Route for Recent Activity
 @app.route('/api/dashboard/activity', methods=['GET'])
 def get_recent_activity():
-    if 'user_id' not in session:
-        return jsonify({'error': 'Unauthorized'}), 401
-    
-    user_id = session['user_id']
+    user_id = g.user_id
     
     # Get recent surveys
-    recent_surveys = Survey.query.filter_by(user_id=user_id).order_by(Survey.created_at.desc()).limit(5).all()
+    recent_surveys = db.session.scalars(
+        select(Survey).where(Survey.user_id == user_id).order_by(Survey.created_at.desc()).limit(5)
+    ).all()
     
     activity = []
     for survey in recent_surveys:
         activity.append({
             'type': 'survey',
             'title': f'Created "{survey.title}"',
-            'time': survey.created_at.strftime('%b %d, %Y')
+            'time': survey.created_at
         })
     
-    return jsonify(activity)
+    return _json_response(activity)
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)